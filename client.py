@@ -1,6 +1,8 @@
 import asyncio # 导入 asyncio 库，用于异步 I/O 操作
-import json # 导入 json 库，用于处理 JSON 数据
 import os # 导入 os 库，用于与操作系统交互，例如读取环境变量
+import orjson # 导入 orjson 库，用于快速处理 JSON 数据
+import sys # 导入 sys 库，用于读取标准输入
+import threading # 导入 threading 库，用于在后台线程中读取标准输入
 import anyio # Import anyio for exception handling
 
 from typing import Optional # 从 typing 模块导入 Optional 类型提示，表示变量可以是指定类型或 None
@@ -10,21 +12,84 @@ from mcp import ClientSession, StdioServerParameters # 从 mcp 库导入 ClientS
 from mcp.client.stdio import stdio_client # 从 mcp.client.stdio 模块导入 stdio_client 函数
 
 from dotenv import load_dotenv # 从 dotenv 库导入 load_dotenv 函数，用于从 .env 文件加载环境变量
-from openai import OpenAI # 从 openai 库导入 OpenAI 类，用于与 OpenAI API 交互
+from openai import AsyncOpenAI # 从 openai 库导入 AsyncOpenAI 类，用于以异步方式与 OpenAI API 交互
+from openai.types.chat import ChatCompletionMessage # 导入 ChatCompletionMessage，用于组装流式响应
 
 load_dotenv() # 加载当前目录或父目录中的 .env 文件中的环境变量
 
+# Read the settings once at import instead of on every LLM call
+API_URL = os.getenv("API_URL")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+MODEL_NAME = os.getenv("MODEL_NAME")
+if not MODEL_NAME:
+    raise ValueError("MODEL_NAME is not set. Add it to your .env file.")
+MCP_DEBUG = bool(os.getenv("MCP_DEBUG")) # Dump messages and responses around each LLM call
 
-llm_client = OpenAI( # 创建一个 OpenAI 客户端实例
-    base_url=os.getenv("API_URL"), # 设置 API 的基础 URL，从环境变量 "API_URL" 获取
-    api_key=os.getenv("OPENAI_API_KEY"), # 设置 API 密钥，从环境变量 "OPENAI_API_KEY" 获取
+
+llm_client = AsyncOpenAI( # 创建一个异步 OpenAI 客户端实例，避免 LLM 调用阻塞事件循环
+    base_url=API_URL, # 设置 API 的基础 URL，从环境变量 "API_URL" 获取
+    api_key=OPENAI_API_KEY, # 设置 API 密钥，从环境变量 "OPENAI_API_KEY" 获取
 )
 
 
+async def stream_chat_completion(**kwargs):
+    """Stream a completion from the LLM, printing content as it arrives; returns (message, finish_reason)"""
+    stream = await llm_client.chat.completions.create(stream=True, **kwargs)
+
+    content_parts = []
+    tool_calls = {} # Tool call deltas merged by their index in the final message
+    finish_reason = None
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        delta = choice.delta
+        if delta.content:
+            if not content_parts:
+                print() # Start the streamed answer on its own line
+            print(delta.content, end="", flush=True)
+            content_parts.append(delta.content)
+        for tool_call_delta in delta.tool_calls or []:
+            tool_call = tool_calls.setdefault(tool_call_delta.index, {
+                "id": f"call_{tool_call_delta.index}",
+                "type": "function",
+                "function": {"name": "", "arguments": ""},
+            })
+            if tool_call_delta.id:
+                tool_call["id"] = tool_call_delta.id
+            if tool_call_delta.function:
+                if tool_call_delta.function.name:
+                    tool_call["function"]["name"] = tool_call_delta.function.name
+                if tool_call_delta.function.arguments:
+                    tool_call["function"]["arguments"] += tool_call_delta.function.arguments
+        if choice.finish_reason:
+            finish_reason = choice.finish_reason
+
+    message = ChatCompletionMessage.model_validate({
+        "role": "assistant",
+        "content": "".join(content_parts) or None,
+        "tool_calls": [tool_calls[index] for index in sorted(tool_calls)] or None,
+    })
+    return message, finish_reason
+
+
+MAX_TOOL_ROUNDS = 5 # Upper bound on chained tool-calling rounds per query
+
+
+def count_tokens(message) -> int:
+    """Estimate the tokens in a message, close enough to keep the history under budget for any model"""
+    text = message.get("content") or ""
+    for tool_call in message.get("tool_calls") or []:
+        text += tool_call.function.name + tool_call.function.arguments
+    return len(text) // 4 # Rough rule of thumb: ~4 characters per token
+
+
 class MCPClient: # 定义一个名为 MCPClient 的类
     def __init__(self):
         self.session: Optional[ClientSession] = None
         self.exit_stack = AsyncExitStack()
+        self.available_tools = () # Tool definitions in OpenAI format, refreshed on (re)connect
+        self.max_history_tokens = 8000 # Older turns are dropped once the history grows past this
         # Initialize message history with the system prompt
         self.messages = [
             {
@@ -40,143 +105,172 @@ class MCPClient: # 定义一个名为 MCPClient 的类
             "content": query
         })
 
-        response = await self.session.list_tools()
-        available_tools = [{
-            "type": "function",
-            "function": {
-                "name": tool.name,
-                "description": tool.description,
-                "parameters": {
-                    "type": tool.inputSchema["type"],
-                    "required": tool.inputSchema["required"],
-                    "properties": tool.inputSchema["properties"],
-                }
-            }
-        } for tool in response.tools]
-        #print(json.dumps(available_tools, indent=4))
-
-        # Initial Claude API call # 对 LLM (如 Claude 或 OpenAI 模型) 进行初始 API 调用
-        first_response = llm_client.chat.completions.create(
-            model=os.getenv("MODEL_NAME"),
-            messages=self.messages,
-            tools=available_tools,
-            tool_choice="auto",
-            max_tokens=4096,
-            temperature=0,
-        )
-
-        # Extract the first message choice
-        first_message = first_response.choices[0].message
+        # Let the model chain tool calls, one batch per round, until it answers on its own
+        for round_number in range(MAX_TOOL_ROUNDS + 1):
+            if MCP_DEBUG:
+                print(f"\n[DEBUG] Messages before LLM call (round {round_number + 1}):")
+                try:
+                    # tool_calls in the history are pydantic models from the OpenAI SDK
+                    print(orjson.dumps(self.messages, option=orjson.OPT_INDENT_2, default=lambda obj: obj.model_dump()).decode())
+                except Exception as e:
+                    print(f"Could not serialize messages: {e}")
+
+            # On the last round tool calls are forbidden so the model has to answer with what it has.
+            # The tools are still sent: the history references them, and the API rejects an empty list.
+            tool_choice = "auto" if round_number < MAX_TOOL_ROUNDS else "none"
+
+            # The OpenAI SDK serializes the tool_calls objects in the history itself
+            message, finish_reason = await stream_chat_completion(
+                model=MODEL_NAME,
+                messages=self.messages,
+                max_tokens=4096,
+                temperature=0,
+                tools=self.available_tools,
+                tool_choice=tool_choice,
+            )
+            if MCP_DEBUG:
+                print(f"\n[DEBUG] Response from LLM call (round {round_number + 1}):")
+                print(message, finish_reason)
+
+            # Append the assistant's response (or tool calls) to the history
+            self.messages.append({
+                "role": "assistant",
+                "content": message.content,
+                "tool_calls": message.tool_calls,
+            })
+
+            stop_reason = (
+                "tool_calls"
+                if message.tool_calls is not None
+                else finish_reason
+            )
+
+            if stop_reason == "stop":
+                break
+            elif stop_reason != "tool_calls":
+                raise ValueError(f"Unknown stop reason: {stop_reason}")
+
+            await self._call_tools(message.tool_calls)
+
+        # Keep the history bounded so every later LLM call doesn't resend the whole session
+        self._trim_history()
+
+        final_message_content = message.content
+        if stop_reason == "tool_calls" and not final_message_content:
+            # The rounds ran out without an answer, so say why instead of printing nothing
+            final_message_content = f"Stopped after {MAX_TOOL_ROUNDS} rounds of tool calls without a final answer."
+            print("\n" + final_message_content, end="", flush=True)
 
-        # Append the assistant's response (or tool calls) to the history
-        self.messages.append({
-            "role": "assistant",
-            "content": first_message.content,
-            "tool_calls": first_message.tool_calls,
-        })
+        # Return the final assistant response content
+        return final_message_content
 
-        stop_reason = (
-            "tool_calls"
-            if first_message.tool_calls is not None
-            else first_response.choices[0].finish_reason
-        )
+    async def _call_tools(self, tool_calls):
+        """Run one batch of tool calls concurrently and append their results to the history"""
+        # Every tool call must get a reply in the history, so failures are kept as results in call order
+        tool_results = [None] * len(tool_calls)
 
-        tool_results_for_next_call = [] # Store tool results for the next LLM call
-        if stop_reason == "tool_calls":
-            for tool_call in first_message.tool_calls:
+        # Parse arguments and start every tool call up front so independent tools run concurrently
+        coros = {}
+        for index, tool_call in enumerate(tool_calls):
+            try:
                 arguments = (
-                    json.loads(tool_call.function.arguments)
+                    orjson.loads(tool_call.function.arguments)
                     if isinstance(tool_call.function.arguments, str)
                     else tool_call.function.arguments
                 )
-                print(f"Using tool: {tool_call.function.name}")
-                tool_result = await self.session.call_tool(tool_call.function.name, arguments=arguments)
-
-                # Prepare tool result message for history and next call
-                tool_result_message = {
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "name": tool_call.function.name,
-                    "content": tool_result.content[0].text,
-                }
-                self.messages.append(tool_result_message) # Add tool result to history
-                tool_results_for_next_call.append(tool_result_message) # Keep track for potential next call
-
-            # Query LLM again with the tool results included in the history
-            print("\n[DEBUG] Messages before second LLM call:")
-            # Create a JSON-serializable copy of messages before dumping
-            serializable_messages = []
-            for msg in self.messages:
-                serializable_msg = msg.copy()
-                # Handle tool_calls if present
-                if 'tool_calls' in serializable_msg and serializable_msg['tool_calls'] is not None:
-                    # Convert tool_calls to a serializable format
-                    tool_calls_serializable = []
-                    for tc in serializable_msg['tool_calls']:
-                        tool_calls_serializable.append({
-                            'id': tc.id,
-                            'type': tc.type,
-                            'function': {
-                                'name': tc.function.name,
-                                'arguments': tc.function.arguments
-                            }
-                        })
-                    serializable_msg['tool_calls'] = tool_calls_serializable
-                serializable_messages.append(serializable_msg)
-            try:
-                print(json.dumps(serializable_messages, indent=2))
-            except Exception as e:
-                print(f"Could not serialize messages: {e}")
-            
-            # Ensure messages are properly serialized for the LLM call
-            llm_messages = serializable_messages
-            
-            # If we already have tool results, prevent further tool calls
-            if tool_results_for_next_call:
-                new_response = llm_client.chat.completions.create(
-                    model=os.getenv("MODEL_NAME"),
-                    messages=llm_messages,
-                    tools=[], # Disable tools for subsequent calls
-                    max_tokens=4096,
-                    temperature=0,
-                )
+            except orjson.JSONDecodeError as e:
+                # Malformed or truncated (finish_reason "length") arguments: report it, don't run the tool
+                tool_results[index] = e
+                continue
+            print(f"Using tool: {tool_call.function.name}")
+            coros[index] = self.session.call_tool(tool_call.function.name, arguments=arguments)
+
+        # A failing tool must not cancel its siblings, so collect exceptions as results
+        for index, tool_result in zip(coros, await asyncio.gather(*coros.values(), return_exceptions=True)):
+            tool_results[index] = tool_result
+
+        # Append results in the same order as the tool calls were issued
+        connection_error = None
+        for tool_call, tool_result in zip(tool_calls, tool_results):
+            if isinstance(tool_result, (asyncio.exceptions.CancelledError, anyio.EndOfStream, anyio.BrokenResourceError)):
+                connection_error = connection_error or tool_result
+            if isinstance(tool_result, BaseException):
+                # Connection errors like EndOfStream carry no message, so fall back to their type
+                reason = str(tool_result) or type(tool_result).__name__
+                content = f"Error calling tool {tool_call.function.name}: {reason}"
             else:
-                new_response = llm_client.chat.completions.create(
-                    model=os.getenv("MODEL_NAME"),
-                    messages=llm_messages,
-                    tools=available_tools,
-                    tool_choice="auto",
-                    max_tokens=4096,
-                    temperature=0,
-                )
-            print("\n[DEBUG] Response from second LLM call:")
-            print(new_response)
-            final_message_content = new_response.choices[0].message.content
-            #print(f"\n[DEBUG] Final message content extracted: {final_message_content}")
-            # Append the final assistant response to history
-            self.messages.append({"role": "assistant", "content": final_message_content})
+                content = tool_result.content[0].text
 
-        elif stop_reason == "stop":
-            # If the LLM stopped on its own, the content is already in history
-            final_message_content = first_message.content
-            # No need to call LLM again or append assistant message, it's already there
+            self.messages.append({
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "name": tool_call.function.name,
+                "content": content,
+            })
 
-        else:
-            raise ValueError(f"Unknown stop reason: {stop_reason}")
+        # Connection errors still propagate so chat_loop can reconnect, after the history has been answered
+        if connection_error is not None:
+            raise connection_error
+
+    def _trim_history(self):
+        """Drop the oldest turns until the history fits in max_history_tokens"""
+        system_prompt, history = self.messages[0], self.messages[1:]
+
+        # Split at each user message so a tool call is never separated from its results
+        turns = []
+        for message in history:
+            if message["role"] == "user" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+
+        turn_tokens = [sum(count_tokens(message) for message in turn) for turn in turns]
+        total = count_tokens(system_prompt) + sum(turn_tokens)
+
+        # Always keep the system prompt and the latest turn
+        dropped = 0
+        while total > self.max_history_tokens and dropped < len(turns) - 1:
+            total -= turn_tokens[dropped]
+            dropped += 1
+
+        if dropped:
+            self.messages = [system_prompt] + [message for turn in turns[dropped:] for message in turn]
 
-        # Return the final assistant response content
-        #print(f"\n[DEBUG] Returning final message content: {final_message_content}")
-        return final_message_content
 
+    def _start_stdin_reader(self) -> asyncio.Queue:
+        """Read stdin lines on one long-lived thread and hand them to the event loop through a queue"""
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+
+        def read_stdin():
+            try:
+                for line in iter(sys.stdin.readline, ""):
+                    loop.call_soon_threadsafe(lines.put_nowait, line)
+                loop.call_soon_threadsafe(lines.put_nowait, None) # EOF
+            except RuntimeError:
+                pass # The event loop has already closed
+
+        # A single reader owns stdin, so a line is never swallowed by an abandoned read
+        threading.Thread(target=read_stdin, daemon=True).start()
+        return lines
 
     async def chat_loop(self):
         """Run an interactive chat loop"""
         print("\nMCP Client Started!")
         print("Type your queries or 'quit' to exit.")
 
+        # Read input off the event loop so it keeps serving the MCP session while the user types
+        stdin_lines = self._start_stdin_reader()
+
         while True:
             try:
-                query = input("\nQuery: ").strip()
+                print("\nQuery: ", end="", flush=True)
+                try:
+                    line = await stdin_lines.get()
+                except asyncio.CancelledError:
+                    break # Ctrl-C at the prompt: exit rather than treat it as a connection error
+                if line is None:
+                    break # EOF (Ctrl-D)
+                query = line.strip()
 
                 if query.lower() == 'quit':
                     break
@@ -187,10 +281,14 @@ class MCPClient: # 定义一个名为 MCPClient 的类
                     print("Reconnected. Please try your query again.")
                     continue
 
-                response = await self.process_query(query)
-                print("\n" + response)
+                await self.process_query(query) # The answer is printed as it streams in
+                print()
 
             except (asyncio.exceptions.CancelledError, anyio.EndOfStream, anyio.BrokenResourceError) as conn_err: # Catch potential connection errors
+                # Ctrl-C while a query runs cancels the main task; exit instead of reconnecting.
+                # Task.cancelling() is Python 3.11+, older versions fall back to reconnecting.
+                if getattr(asyncio.current_task(), "cancelling", lambda: 0)():
+                    break
                 print(f"\nConnection error: {conn_err}. Attempting to reconnect...")
                 self.session = None # Mark session as invalid
                 try:
@@ -211,6 +309,24 @@ class MCPClient: # 定义一个名为 MCPClient 的类
         await self.exit_stack.aclose()
 
 
+    async def refresh_tools(self):
+        """Fetch the server's tool list and cache it in OpenAI format for process_query"""
+        tools_response = await self.session.list_tools()
+        # Built once per connection and frozen, so every LLM call can reuse it as-is
+        self.available_tools = tuple({
+            "type": "function",
+            "function": {
+                "name": tool.name,
+                "description": tool.description,
+                "parameters": {
+                    "type": tool.inputSchema["type"],
+                    "required": tool.inputSchema["required"],
+                    "properties": tool.inputSchema["properties"],
+                }
+            }
+        } for tool in tools_response.tools)
+        return tools_response.tools
+
     async def connect_to_server(self, server_script_path: str):
         is_python = server_script_path.endswith('.py')
         is_js = server_script_path.endswith('.js')
@@ -230,8 +346,7 @@ class MCPClient: # 定义一个名为 MCPClient 的类
 
         await self.session.initialize()
 
-        tools_response = await self.session.list_tools()
-        tools = tools_response.tools
+        tools = await self.refresh_tools()
         # print("Connected to server with tools:", [tool for tool in tools]) # (注释掉的代码) 打印连接成功信息和工具列表
 
         prompts_response = await self.session.list_prompts()
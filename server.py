@@ -1,16 +1,77 @@
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, date
-import requests
+import functools
+import httpx
+import itertools
 import json
+import logging
+import orjson
+import threading
+from cachetools import TTLCache, cached
+from cachetools.keys import hashkey
 from mcp.server.fastmcp import FastMCP
 from googlesearch import search
-from bs4 import BeautifulSoup
-from markdownify import markdownify as md
+from bs4 import BeautifulSoup, UnicodeDammit
+from markdownify import MarkdownConverter
+from selectolax.lexbor import LexborHTMLParser
 
 
-mcp = FastMCP("My App")
+# httpx logs every request at INFO, which would flood the client's stderr
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Shared client so repeated requests reuse pooled keep-alive connections. httpx advertises
+# and decodes gzip/deflate, plus br when brotli is installed (see requirements.txt).
+_http = httpx.AsyncClient(
+    timeout=10,
+    follow_redirects=True,
+    headers={
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+    },
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+        retries=2,  # Retries failed connection attempts only, never a request that got a response
+    ),
+)
+
+
+@asynccontextmanager
+async def _lifespan(server):
+    try:
+        yield
+    finally:
+        await _http.aclose()
+
+
+def _async_cached(cache):
+    '''
+    Like cachetools.cached, but for coroutine functions. Exceptions are not cached.
+    :param cache: The cache to store results in, keyed by the call arguments.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = hashkey(*args, **kwargs)
+            try:
+                return cache[key]
+            except KeyError:
+                pass
+            result = await func(*args, **kwargs)
+            try:
+                cache[key] = result
+            except ValueError:
+                pass  # Larger than the whole cache (see getsizeof), same as cachetools.cached
+            return result
+        return wrapper
+    return decorator
+
+
+mcp = FastMCP("My App", lifespan=_lifespan)
 
 
 @mcp.tool()
+@functools.lru_cache(maxsize=512)
 def get_weekday_from_date(date_str: str) -> str:
     '''
     input date, return weekday
@@ -26,8 +87,17 @@ def get_weekday_from_date(date_str: str) -> str:
         return "invalid date, use YYYY-MM-DD format."
 
 
+@_async_cached(TTLCache(maxsize=256, ttl=900))  # Weather changes, so keep entries for 15 minutes only
+async def _fetch_weather(city: str) -> dict:
+    # Use wttr.in API (JSON format)
+    url = f"https://wttr.in/{city}"
+    response = await _http.get(url, params={'format': 'j1', 'lang': 'en'})
+    response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+    return orjson.loads(response.content)
+
+
 @mcp.tool()
-def get_weather_for_date(city: str, date_str: str | None = None) -> str:
+async def get_weather_for_date(city: str, date_str: str | None = None) -> str:
     '''
     Get the weather for a specific date and city using wttr.in (no API key needed).
     :param city: The name of the city
@@ -43,31 +113,43 @@ def get_weather_for_date(city: str, date_str: str | None = None) -> str:
         # If a specific date is requested, we inform the user it might not be precise for past/future.
         date_info = f"on or around {target_date_str}" if date_str else f"for today ({target_date_str})"
 
-        # Use wttr.in API (JSON format)
-        url = f"https://wttr.in/{city}?format=j1"
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
-
-        weather_data = response.json()
+        weather_data = await _fetch_weather(city)
 
         # Extract relevant information (example: current condition)
-        current_condition = weather_data.get('current_condition', [{}])[0]
-        description = current_condition.get('weatherDesc', [{}])[0].get('value', 'N/A')
+        # The `or [{}]` fallbacks are only built when a field is missing or empty
+        current_condition = (weather_data.get('current_condition') or [{}])[0]
+        description = (current_condition.get('weatherDesc') or [{}])[0].get('value', 'N/A')
         temp_c = current_condition.get('temp_C', 'N/A')
         feels_like_c = current_condition.get('FeelsLikeC', 'N/A')
 
         return f"Weather for {city} {date_info}: {description}, Temp: {temp_c}°C, Feels like: {feels_like_c}°C."
 
+    # JSONDecodeError (orjson's included) subclasses ValueError, so it must be caught first
+    except (KeyError, IndexError, json.JSONDecodeError):
+        return f"Could not parse weather data for {city}. The city might be invalid or the API response changed."
     except ValueError:
         return "Invalid date format. Please use YYYY-MM-DD."
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return f"Error fetching weather data: {e}"
-    except (KeyError, IndexError, json.JSONDecodeError):
-        return f"Could not parse weather data for {city}. The city might be invalid or the API response changed."
+
+
+class _NoSearchResults(Exception):
+    pass
+
+
+# Runs in a worker thread (see google_search), hence the lock around the shared cache
+@cached(TTLCache(maxsize=256, ttl=3600), lock=threading.Lock())
+def _search(query: str, num_results: int) -> list[str]:
+    # The search function returns a generator, we take the first num_results
+    results = list(itertools.islice(search(query, num_results=num_results), num_results))
+    if not results:
+        # Raise rather than return, so the cache doesn't keep an empty (often rate-limited) lookup
+        raise _NoSearchResults()
+    return results
 
 
 @mcp.tool()
-def google_search(query: str, num_results: int = 5) -> str:
+async def google_search(query: str, num_results: int = 5) -> str:
     '''
     Performs a Google search for the given query.
     :param query: The search query string.
@@ -75,21 +157,89 @@ def google_search(query: str, num_results: int = 5) -> str:
     :return: A string containing the search results, or an error message.
     '''
     try:
-        results = []
-        # The search function returns a generator, we take the first num_results
-        for j in search(query, num_results=num_results):
-            results.append(j)
-            if len(results) >= num_results:
-                break
-        if not results:
-            return f"No results found for '{query}'."
+        # googlesearch makes blocking HTTP requests, so keep them off the event loop
+        results = await asyncio.to_thread(_search, query, num_results)
         return f"Search results for '{query}':\n" + "\n".join(results)
+    except _NoSearchResults:
+        return f"No results found for '{query}'."
     except Exception as e:
         return f"An error occurred during the search: {e}"
 
 
+# Tags that never hold main content. A SoupStrainer can't drop these at parse time: parse_only
+# only filters top-level elements, so anything nested inside <html> would still be kept.
+BOILERPLATE_TAGS = ['script', 'style', 'header', 'footer', 'nav', 'aside', 'form', 'button', 'iframe']
+
+# Common main content containers, matched by one CSS query instead of a chain of find() calls
+MAIN_CONTENT_SELECTOR = 'article, main, div#content, div.content, div#main-content, div.main-content, div[role=main]'
+
+# Elements often found outside main content within body, removed when falling back to the body
+# (header, footer and nav are already gone with the boilerplate tags)
+BODY_CLUTTER_SELECTOR = '.sidebar, #sidebar, .menu, #menu'
+
+
+# Bounded by total body size, not entry count: a few large pages or PDFs could otherwise take hundreds of MB
+@_async_cached(TTLCache(maxsize=32 * 2**20, ttl=3600, getsizeof=len))
+async def _fetch_page(url: str) -> bytes:
+    response = await _http.get(url, headers={'Accept': 'text/html,application/xhtml+xml,*/*;q=0.8'})
+    response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
+    return response.content
+
+
+# Cached apart from the fetch so requesting another format of the same page reuses the parse.
+# A whole bs4 tree can take many MB, so only the last few pages are kept.
+@functools.lru_cache(maxsize=4)
+def _parse_main_content(html: bytes):
+    soup = BeautifulSoup(html, 'lxml')  # C-backed parser, much faster than html.parser on large pages
+
+    # --- Content Extraction Heuristics (Best Effort) ---
+    # Remove common boilerplate tags, all in one traversal of the tree
+    for tag in soup(BOILERPLATE_TAGS):
+        tag.decompose()
+
+    # Try to find common main content containers in a single pass over the tree
+    main_content = soup.select_one(MAIN_CONTENT_SELECTOR)
+
+    # If no specific container found, use the body, but try to clean it
+    if not main_content:
+        main_content = soup.body
+        if main_content:
+             # Remove elements often found outside main content within body
+             for tag in main_content.select(BODY_CLUTTER_SELECTOR):
+                 tag.decompose()
+        else:
+             # Fallback if body is also missing
+             main_content = soup
+
+    return main_content
+
+
+_markdown_converter = MarkdownConverter(heading_style="ATX")
+
+
+def _extract_text(html: bytes) -> str:
+    # Same heuristics as _parse_main_content, on selectolax's C parser: building a bs4 tree
+    # just to pull out the text is far slower. Decode first, lexbor would assume UTF-8.
+    tree = LexborHTMLParser(UnicodeDammit(html, is_html=True).unicode_markup)
+    tree.strip_tags(BOILERPLATE_TAGS)
+
+    main_content = tree.css_first(MAIN_CONTENT_SELECTOR)
+    if main_content is None:
+        main_content = tree.body
+        if main_content is not None:
+            # Query again after each removal so a match inside an already removed node is never touched
+            while (tag := main_content.css_first(BODY_CLUTTER_SELECTOR)) is not None:
+                tag.decompose()
+        else:
+            main_content = tree.root
+
+    # Same output as bs4's get_text(separator='\n', strip=True): one stripped, non-empty string per line
+    strings = (node.text_content.strip() for node in main_content.traverse(include_text=True) if node.is_text_node)
+    return '\n'.join(string for string in strings if string)
+
+
 @mcp.tool()
-def get_web_content(url: str, format: str = 'markdown') -> str:
+async def get_web_content(url: str, format: str = 'markdown') -> str:
     '''
     Fetches the main content of a web page and returns it in the specified format.
     Attempts to remove common boilerplate like headers, footers, and navigation.
@@ -102,53 +252,25 @@ def get_web_content(url: str, format: str = 'markdown') -> str:
         return f"Error: Unsupported format '{format}'. Supported formats are: {', '.join(supported_formats)}"
 
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        # --- Content Extraction Heuristics (Best Effort) ---
-        # Remove common boilerplate tags
-        for tag in soup(['script', 'style', 'header', 'footer', 'nav', 'aside', 'form', 'button', 'iframe']): # Added form, button, iframe
-            tag.decompose()
-
-        # Try to find common main content containers
-        main_content = soup.find('article') or \
-                       soup.find('main') or \
-                       soup.find('div', {'id': 'content'}) or \
-                       soup.find('div', {'class': 'content'}) or \
-                       soup.find('div', {'id': 'main-content'}) or \
-                       soup.find('div', {'class': 'main-content'}) or \
-                       soup.find('div', {'role': 'main'}) # Added role='main'
-
-        # If no specific container found, use the body, but try to clean it
-        if not main_content:
-            main_content = soup.body
-            if main_content:
-                 # Remove elements often found outside main content within body
-                 for selector in ['header', 'footer', 'nav', '.sidebar', '#sidebar', '.menu', '#menu']:
-                     for tag in main_content.select(selector):
-                         tag.decompose()
-            else:
-                 # Fallback if body is also missing
-                 main_content = soup
+        html = await _fetch_page(url)
+        if format.lower() == 'text':
+            # Extract text, trying to preserve some structure
+            return _extract_text(html)
+
+        main_content = _parse_main_content(html)
 
         # --- Formatting ---
         if format.lower() == 'html':
             return str(main_content)
         elif format.lower() == 'markdown':
-            # Convert HTML to Markdown
-            return md(str(main_content), heading_style="ATX")
-        elif format.lower() == 'text':
-            # Extract text, trying to preserve some structure
-            return main_content.get_text(separator='\n', strip=True)
+            # Convert the parsed tree directly; md(str(...)) would serialize it only to parse it again.
+            # markdownify strips the newlines around a whole document, but not around a single tag.
+            # Needs markdownify>=1.0: older versions extract() whitespace nodes, corrupting the cached tree.
+            return _markdown_converter.convert_soup(main_content).strip('\n')
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         return f"Error: Request timed out while fetching {url}."
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return f"Error fetching URL {url}: {e}"
     except Exception as e:
         return f"An unexpected error occurred while processing {url}: {e}"